@@ -1,25 +1,39 @@
 from src.logger import Logger
 from time import sleep
+import logging
+import logging.handlers
+import queue
 
 if __name__ == '__main__':
+    # Shows each received message. Printing happens on a separate thread so the receiving thread
+    # only ever puts records on a queue
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    logging.basicConfig(level=logging.INFO, format='%(message)s',
+                        handlers=[logging.handlers.QueueHandler(log_queue)])
+    log_listener.start()
+
     udp_socket = ('localhost', 50001)
-    l = Logger(udp_socket=udp_socket)
-    l.start()
-    sleep(1)
+    # Stopped even on Ctrl-C, so queued messages and the final status lines still get printed
+    try:
+        with Logger(udp_socket=udp_socket) as l:
+            l.start()
+            sleep(1)
 
-    close_logger = False
-    while not close_logger:
-        instruction = ''
-        try:
-            instruction = input("Type exit to end logger.\n")
-        except Exception as e:
-            print(f'Exception occurred: {e}')
-            close_logger = True
+            close_logger = False
+            while not close_logger:
+                instruction = ''
+                try:
+                    instruction = input("Type exit to end logger.\n")
+                except Exception as e:
+                    print(f'Exception occurred: {e}')
+                    close_logger = True
 
-        if instruction.strip().upper() == 'EXIT':
-            close_logger = True
-        elif instruction != '':
-            print(f'Did not understand input: {instruction}')
+                if instruction.strip().upper() == 'EXIT':
+                    close_logger = True
+                elif instruction != '':
+                    print(f'Did not understand input: {instruction}')
 
-    print('Exiting')
-    l.stop()
+            print('Exiting')
+    finally:
+        log_listener.stop()
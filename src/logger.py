@@ -1,19 +1,58 @@
 import sqlite3
-import pandas as pd
 import socket
 from datetime import datetime, timedelta
-import re
 from collections import defaultdict
 import threading
+import queue
+import selectors
+from time import monotonic
 import os
-import pathlib
+import logging
 
 # TODO: Test logging and data updating functionality
 # TODO: implement analysis functionality
 
+# Per message output. Silent unless the application configures logging at INFO level
+_log = logging.getLogger(__name__)
+_log.addHandler(logging.NullHandler())
+
+# Applied to every database connection. Under WAL, synchronous=NORMAL only syncs on checkpoint
+# rather than on every commit, and is still safe against corruption.
+DATABASE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=1073741824',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA busy_timeout=5000',
+]
+
+# Layout of a BadgeScans row, and the index of each column within it
+COLUMNS = ['ID', 'Session', 'A', 'B', 'C', 'V', 'H', 'Notes']
+COL = {name: i for i, name in enumerate(COLUMNS)}
+
+# Stations a badge scan can come from
+_STATIONS = frozenset(b'ABCVH')
+
+def parse_scan(data):
+    """
+    Parses a badge scan message straight from the bytes received
+
+    :param data: Message received from udp socket
+    :type data: bytes
+    :return: (station, id) if message is a station card combo, otherwise None
+    :rtype: tuple of string
+    """
+    # Station, space and a 7 or 8 character id of [0-9A-Za-z_], e.g. b"A 11111111"
+    data = data.rstrip()
+    if (len(data) in (9, 10) and data[1] == 0x20 and data[0] in _STATIONS and
+            data[2:].replace(b'_', b'0').isalnum()):
+        return chr(data[0]), data[2:].decode('ascii')
+    return None
+
 class Logger(threading.Thread):
 
-    def __init__(self, log_files=None, database='./data/scans.db', udp_socket=None, auto_save=True):
+    def __init__(self, log_files=None, database='./data/scans.db', udp_socket=None, auto_save=True, receivers=1):
         """
         Logger object to handle writing and interpreting udp messages
 
@@ -25,36 +64,75 @@ class Logger(threading.Thread):
         :type udp_socket:
         :param auto_save: Option to automatically save data when logger is deleted
         :type auto_save: bool
+        :param receivers: Number of threads receiving on the udp port. More than one needs SO_REUSEPORT.
+            Messages are put back in receive order within each batch written, across batches it is best-effort
+        :type receivers: int
         :return: None
         """
 
         super().__init__()
 
         self.log_files = log_files
+        self._log_handles = {}
+        # Lines waiting to be written to every text log file
+        self._log_lines = []
+        self.log_flush_interval = 32
+        self._unflushed_writes = 0
+        # Seconds buffered lines may wait before being flushed, however few there are
+        self.log_flush_period = 1
+        self._last_log_flush = monotonic()
         self.setup_database(database)
+        # Rows waiting to be written to the Logs and BadgeScans tables
+        self._pending_logs = []
+        self._pending_scans = []
+        self.database_batch_size = 256
+        self.database_flush_interval = 1
+        self._last_database_flush = monotonic()
+        self.optimize_interval = 15 * 60
+        self._last_optimize = monotonic()
         self.auto_save = auto_save
 
         self.last_write = datetime.now()
         self.current_session = self.last_write.date()
+        self._session_stamp = f'{self.current_session:%m.%d.%y}'
+        # Last formatted timestamp and the second it is valid for
+        self._timestamp = ''
+        self._timestamp_start = self._timestamp_end = datetime.min
         self.listening = False
-        self._stop_event = None
+        self._stop_event = threading.Event()
+        # Received messages, handed from the listening thread to the writer thread
+        self._writer_queue = queue.SimpleQueue()
+        self.write_batch_size = 128
 
-        self.finished = pd.DataFrame(data=[], columns=['ID', 'Session', 'A', 'B', 'C', 'V', 'H', 'Notes'])
-        self.ongoing = defaultdict(lambda: pd.DataFrame(
-            data=[[None, self.current_session, None, None, None, None, None, '']],
-            columns=['ID', 'Session', 'A', 'B', 'C', 'V', 'H', 'Notes']))
+        # Messages that are not scans, shared by every ongoing entry
+        self._notes = []
+        # Each ongoing entry is a plain list laid out as COLUMNS. Its Notes hold the position in _notes
+        # the entry started at, and are only joined when the entry is finalized
+        self.ongoing = defaultdict(lambda: [None, self.current_session, None, None, None, None, None, len(self._notes)])
 
         self.buffer_size = 1024
+        self.socket_buffer_size = 8 * 1024 * 1024
+        self.batch_size = 64
+        self.receivers = receivers
+        if self.receivers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            print('SO_REUSEPORT not supported, using a single receiver.')
+            self.receivers = 1
         self.udp_socket = None
         if type(udp_socket) in [list, tuple] and len(udp_socket) == 2:
             self.udp_host, self.udp_port = udp_socket
             self.create_udp_socket(self.udp_host, self.udp_port)
         elif type(udp_socket) == socket.socket:
             self.udp_socket = udp_socket
-            socket_info = re.match(r"[\w\W\s]*laddr=\('(\d+.\d+.\d+.\d+)', (\d+)\)>", str(udp_socket))
-            if socket_info is not None:
-                self.udp_host = socket_info[1]
-                self.udp_port = socket_info[2]
+            if self.receivers > 1:
+                # Was not created with SO_REUSEPORT, so no other socket can bind its port
+                print('Cannot share a udp socket passed in, using a single receiver.')
+                self.receivers = 1
+            try:
+                self.udp_host, self.udp_port = udp_socket.getsockname()[:2]
+            except OSError:
+                print('Could not get udp socket address.')
+                self.udp_host = None
+                self.udp_port = None
         elif udp_socket is None:
             self.udp_host = None
             self.udp_port = None
@@ -63,9 +141,16 @@ class Logger(threading.Thread):
             self.udp_host = None
             self.udp_port = None
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def __del__(self):
         """
-        Closes udp socket and dumps data into file
+        Closes udp socket and dumps data into file.
+        Not reliable during interpreter shutdown, use close() or a with block instead
 
         :return: None
         """
@@ -74,6 +159,24 @@ class Logger(threading.Thread):
         # if self.auto_save:
         #     self.dump_data()
 
+    def close(self):
+        """
+        Stops listening if needed, then writes out everything still buffered and closes the
+        udp socket, log files and database. Safe to call more than once
+
+        :return: None
+        """
+        if self.is_alive():
+            self.stop()
+            self.join()
+        if self.udp_socket is not None:
+            self.close_udp()
+        self.close_text_log_files()
+        if self.auto_save:
+            self.dump_data()
+        self.flush_database()
+        self.close_database()
+
     def run(self):
         """
         Sets logger to listen to udp socket, recording messages, until Keyboard Interrupt or other error
@@ -89,37 +192,137 @@ class Logger(threading.Thread):
             self.create_udp_socket()
         print(f'Listening for UDP messages on {self.udp_host}:{self.udp_port}')
 
-        self._stop_event = threading.Event()
-        self.listening = True
-        while not self._stop_event.is_set():
-            try:
-                data, addr = self.udp_socket.recvfrom(self.buffer_size)
-                data = data.decode('ascii')
-                time = datetime.now()
-                print(f'{time:%Y-%m-%d %H:%M:%S} - Received message from {addr}: {data}')
-
-                self.update_session(time)
-                self.log_to_text_files(time, data)
-                self.log_to_database(time, data)
-                self.update_data(time, data)
-            except TimeoutError:
-                # Designed to happen so stop event can trigger thread end
-                pass
-            except Exception as e:
-                raise e.with_traceback()
-                print(f'Error occurred: {e}')
-                self._stop_event.set()
-
-        self.close_udp()
+        # Extra receivers get their own socket on the same port, the kernel spreads senders across them.
+        # Bound before any thread starts, so a failed bind leaves nothing running
+        extra_sockets = []
+        try:
+            for i in range(self.receivers - 1):
+                extra_sockets.append(self.bind_udp_socket())
+        except OSError:
+            for udp_socket in extra_sockets:
+                udp_socket.close()
+            raise
+
+        writer = threading.Thread(target=self._writer_loop)
+        writer.start()
+        receivers = []
+        try:
+            for udp_socket in extra_sockets:
+                receiver = threading.Thread(target=self._receive_loop, args=(udp_socket,))
+                receiver.start()
+                receivers.append(receiver)
+            self.listening = True
+
+            self._receive_loop(self.udp_socket)
+        finally:
+            # Always ends the other threads, even if receiving failed, or they would keep the process alive
+            self._stop_event.set()
+            for receiver in receivers:
+                receiver.join()
+
+            self.close_udp()
+            # Lets the writer finish everything already queued before saving
+            self._writer_queue.put(None)
+            writer.join()
+            self.listening = False
+
+        self.close_text_log_files()
         if self.auto_save:
             print('Saving data...')
             self.dump_data()
+        self.flush_database()
+        self.close_database()
 
-        self.listening = False
         print(f'No longer listening for UDP messages on {self.udp_host}:{self.udp_port}')
 
+    def _receive_loop(self, udp_socket):
+        """
+        Receives messages on udp_socket and queues them for the writer thread, until stopped
+
+        :param udp_socket: Socket to receive from
+        :type udp_socket: socket.socket
+        :return: None
+        """
+        # Reused by every receive instead of allocating a new buffer per message
+        buffer = memoryview(bytearray(self.buffer_size))
+        udp_socket.setblocking(False)
+        with selectors.DefaultSelector() as selector:
+            selector.register(udp_socket, selectors.EVENT_READ)
+            while not self._stop_event.is_set():
+                # Wakes up regularly so the stop event can end the thread
+                if not selector.select(timeout=0.5):
+                    continue
+                try:
+                    # Takes everything already queued so it is all written in one go
+                    received = self.drain_udp_socket(udp_socket, buffer, self.batch_size)
+                except OSError as e:
+                    print(f'Error occurred: {e}')
+                    self._stop_event.set()
+                    break
+                if not received:
+                    continue
+
+                # Skips formatting entirely when nobody is listening for it
+                if _log.isEnabledFor(logging.INFO):
+                    for time, addr, data in received:
+                        _log.info(f'{time:%Y-%m-%d %H:%M:%S} - Received message from {addr}: '
+                                  f'{data.decode("ascii", "replace")}')
+                self._writer_queue.put([(time, data) for time, addr, data in received])
+
+        if udp_socket is not self.udp_socket:
+            udp_socket.close()
+
+    def _writer_loop(self):
+        """
+        Logs and adds to data messages queued by the listening thread, until None is queued.
+        Keeps file and database writes off the listening thread so it can keep receiving
+
+        :return: None
+        """
+        try:
+            finished = False
+            while not finished:
+                if monotonic() - self._last_optimize >= self.optimize_interval:
+                    try:
+                        self.optimize_database()
+                    except sqlite3.OperationalError as e:
+                        print(f'Could not optimize database: {e}')
+                        self._last_optimize = monotonic()
+
+                try:
+                    batch = self._writer_queue.get(timeout=2)
+                except queue.Empty:
+                    # Nothing received for a while, so a good time to push out buffered log lines and rows
+                    self.flush_text_log_files()
+                    self.retry_flush_database()
+                    continue
+
+                # Picks up anything else queued in the meantime so it is all written in one go
+                messages = []
+                while batch is not None:
+                    messages += batch
+                    if len(messages) >= self.write_batch_size:
+                        break
+                    try:
+                        batch = self._writer_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                finished = batch is None
+
+                if self.receivers > 1:
+                    # Each receiver queues its own batches, so puts scans of the same card back in receive order
+                    messages.sort(key=lambda message: message[0])
+                self.process_messages(messages)
+                if self.database_flush_due():
+                    self.retry_flush_database()
+        except BaseException:
+            # Nothing received can be saved any more, so stops receiving rather than queueing it forever
+            print('Writer failed, no longer listening.')
+            self._stop_event.set()
+            raise
+
     def stop(self):
-        if self.listening:
+        if self.is_alive():
             self._stop_event.set()
         else:
             print('Not currently listening.')
@@ -137,11 +340,52 @@ class Logger(threading.Thread):
             self.udp_host = udp_host
         if overwrite or self.udp_port is None:
             self.udp_port = udp_port
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.udp_socket.bind((self.udp_host, self.udp_port))
-        self.udp_socket.settimeout(2)
+        self.udp_socket = self.bind_udp_socket()
+        # With port 0 the system picks one, which extra receivers then need to bind to
+        self.udp_port = self.udp_socket.getsockname()[1]
         return self.udp_socket
 
+    def bind_udp_socket(self):
+        """
+        Creates a udp socket bound to the logger's host and port.
+        With more than one receiver, the port is shared so each receiver can bind its own socket
+
+        :return: udp socket
+        """
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.receivers > 1:
+            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Room for bursts to queue up while the previous batch is being written
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size)
+        udp_socket.bind((self.udp_host, self.udp_port))
+        return udp_socket
+
+    def drain_udp_socket(self, udp_socket, buffer, max_messages):
+        """
+        Receives messages already waiting on a non-blocking udp socket
+
+        :param udp_socket: Socket to receive from, in non-blocking mode
+        :type udp_socket: socket.socket
+        :param buffer: Reusable receive buffer
+        :type buffer: memoryview
+        :param max_messages: Maximum number of messages to receive
+        :type max_messages: int
+        :return: list of (time, address, data) tuples
+        """
+        received = []
+        # Hot loop, so everything it calls is bound to a local first
+        append = received.append
+        recvfrom_into = udp_socket.recvfrom_into
+        now = datetime.now
+        for i in range(max_messages):
+            try:
+                nbytes, addr = recvfrom_into(buffer)
+            except BlockingIOError:
+                break
+            # Copied out, as the buffer is reused before the batch is processed
+            append((now(), addr, bytes(buffer[:nbytes])))
+        return received
+
     def close_udp(self):
         """
         Closes udp connection
@@ -162,10 +406,9 @@ class Logger(threading.Thread):
         if self.log_files is None:
             self.log_files = [
                 './data/udp_log_ALL.txt',
-                f'./data/udp_log_{self.current_session:%m.%d.%y}.txt'
+                f'./data/udp_log_{self._session_stamp}.txt'
             ]
-            if not os.path.exists('./data'):
-                os.mkdir('./data')
+            os.makedirs('./data', exist_ok=True)
         return self.log_files
 
     def get_database_connection(self):
@@ -175,9 +418,57 @@ class Logger(threading.Thread):
         :return: database connection
         :rtype: sqlite3.Connection
         """
-        conn = sqlite3.connect(self.database)
-        conn.cursor().execute("PRAGMA jojurnal_mode=wal")
-        return conn
+        if self._conn is None:
+            # Shared between the thread creating the logger and the writer thread. Autocommit, so
+            # transactions are only ever opened explicitly with BEGIN
+            self._conn = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None)
+            self.configure_connection(self._conn)
+        return self._conn
+
+    def close_database(self):
+        """
+        Closes the database connection. A new one is opened on next use
+
+        :return: None
+        """
+        if self._conn is not None:
+            # Folds the write-ahead log back into the database so it does not linger at full size
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._conn.close()
+            self._conn = None
+
+    def optimize_database(self):
+        """
+        Lets SQLite refresh its query planner statistics. Meant to be run periodically
+
+        :return: None
+        """
+        self.get_database_connection().execute('PRAGMA optimize')
+        self._last_optimize = monotonic()
+
+    @staticmethod
+    def rollback(conn):
+        """
+        Rolls back the open transaction on a database connection, if there is one
+
+        :param conn: Database connection
+        :type conn: sqlite3.Connection
+        :return: None
+        """
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+
+    @staticmethod
+    def configure_connection(conn):
+        """
+        Applies DATABASE_PRAGMAS to a database connection
+
+        :param conn: Database connection
+        :type conn: sqlite3.Connection
+        :return: None
+        """
+        for pragma in DATABASE_PRAGMAS:
+            conn.execute(pragma)
 
     def setup_database(self, database):
         """
@@ -191,38 +482,40 @@ class Logger(threading.Thread):
         database_exists = os.path.exists(database)
 
         # Generates folder structure
-        folder = '/'.join(database.split('/')[:-1])
-        if not os.path.exists(folder):
-            pathlib.Path(folder).mkdir(parents=True)
+        os.makedirs(os.path.dirname(database) or '.', exist_ok=True)
 
         # Connecting to database
         self.database = database
-        conn = sqlite3.connect(database)
-        c = conn.cursor()
-        c.execute("PRAGMA journal_mode=wal")
+        self._conn = None
+        conn = self.get_database_connection()
 
         # If database did not exist, creates structure of tables
         if not database_exists:
-            c.execute("""
-                CREATE TABLE Logs(
-                    time TEXT,
-                    session TEXT,
-                    message TEXT
-                );
-            """)
-            c.execute("""
-                CREATE TABLE BadgeScans(
-                    id TEXT,
-                    session TEXT,
-                    a_time TEXT,
-                    b_time TEXT,
-                    c_time TEXT,
-                    v_time TEXT,
-                    h_time TEXT,
-                    notes TEXT
-                );
-            """)
-            conn.commit()
+            conn.execute('BEGIN')
+            try:
+                conn.execute("""
+                    CREATE TABLE Logs(
+                        time TEXT,
+                        session TEXT,
+                        message TEXT
+                    );
+                """)
+                conn.execute("""
+                    CREATE TABLE BadgeScans(
+                        id TEXT,
+                        session TEXT,
+                        a_time TEXT,
+                        b_time TEXT,
+                        c_time TEXT,
+                        v_time TEXT,
+                        h_time TEXT,
+                        notes TEXT
+                    );
+                """)
+                conn.execute('COMMIT')
+            except BaseException:
+                self.rollback(conn)
+                raise
 
     def update_session(self, time):
         """
@@ -232,70 +525,183 @@ class Logger(threading.Thread):
         :param time: Time of current write
         :return:
         """
-        if (time.date() != self.current_session and
-                (time - self.last_write) / timedelta(hours=1) > 1):
+        if time.date() == self.current_session:
+            # Nearly every message, so kept to a single comparison
+            return
+        if (time - self.last_write) / timedelta(hours=1) > 1:
             print('Updating session and log files.')
-            # Update any log files\
+            # Update any log files
+            self.close_text_log_files()
+            session_stamp = f'{time:%m.%d.%y}'
             log_files = self.get_text_log_files()
             for i in range(len(log_files)):
-                log_files[i] = log_files[i].replace(
-                    f'{self.current_session:%m.%d.%y}',
-                    f'{time:%m.%d.%y}'
-                )
+                log_files[i] = log_files[i].replace(self._session_stamp, session_stamp)
             self.current_session = time.date()
+            self._session_stamp = session_stamp
 
-    def log_to_text_files(self, time, message):
+    def format_timestamp(self, time):
         """
-        Logs message and time to text log files
+        Formats time for the logs, reusing the previous result for times within the same second
 
         :param time: Time of the message
-        :type time: datetime formatted as YYYY-MM-DD HH-MM-SS
+        :type time: datetime
+        :return: time formatted as YYYY-MM-DD HH:MM:SS
+        :rtype: string
+        """
+        if not self._timestamp_start <= time < self._timestamp_end:
+            self._timestamp_start = time.replace(microsecond=0)
+            self._timestamp_end = self._timestamp_start + timedelta(seconds=1)
+            self._timestamp = self._timestamp_start.strftime('%Y-%m-%d %H:%M:%S')
+        return self._timestamp
+
+    def log_to_text_files(self, timestamp, message):
+        """
+        Queues message and time for the text log files. Written on the next write_text_log_files
+
+        :param timestamp: Time of the message
+        :type timestamp: string formatted as YYYY-MM-DD HH:MM:SS
         :param message: Message received from udp socket
         :type message: string
         :return: None
         """
+        self._log_lines.append(f'{timestamp} - {message}\n')
+
+    def write_text_log_files(self):
+        """
+        Writes all queued lines to each text log file in one call per file
+
+        :return: None
+        """
+        if not self._log_lines:
+            return
         for file_name in self.get_text_log_files():
-            with open(file_name, 'a+') as file:
-                file.write(f'{time:%Y-%m-%d %H:%M:%S} - {message}\n')
+            file = self._log_handles.get(file_name)
+            if file is None:
+                file = open(file_name, 'a', buffering=1 << 16)
+                self._log_handles[file_name] = file
+            file.writelines(self._log_lines)
 
-    def log_to_database(self, time, message):
+        self._unflushed_writes += len(self._log_lines)
+        self._log_lines.clear()
+        if self.text_log_flush_due():
+            self.flush_text_log_files()
+
+    def flush_text_log_files(self):
         """
-        Logs message and time to database Logs table
+        Writes queued lines and flushes buffered writes of any open text log files
 
-        :param time: Time of the message
-        :type time: datetime formatted as YYYY-MM-DD HH-MM-SS
+        :return: None
+        """
+        self.write_text_log_files()
+        for file in self._log_handles.values():
+            file.flush()
+        self._unflushed_writes = 0
+        self._last_log_flush = monotonic()
+
+    def text_log_flush_due(self):
+        """
+        Checks if enough lines have been written, or enough time has passed, to flush the text log files
+
+        :return: True if flush_text_log_files should be called
+        :rtype: bool
+        """
+        return (self._unflushed_writes >= self.log_flush_interval or
+                monotonic() - self._last_log_flush >= self.log_flush_period)
+
+    def close_text_log_files(self):
+        """
+        Writes queued lines and closes any open text log files. They are reopened on next write
+
+        :return: None
+        """
+        self.write_text_log_files()
+        for file in self._log_handles.values():
+            file.close()
+        self._log_handles.clear()
+        self._unflushed_writes = 0
+
+    def log_to_database(self, timestamp, message):
+        """
+        Queues message and time for the database Logs table. Written on the next flush_database
+
+        :param timestamp: Time of the message
+        :type timestamp: string formatted as YYYY-MM-DD HH:MM:SS
         :param message: Message received from udp socket
         :type message: string
         :return: None
         """
-        conn = self.get_database_connection()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO Logs VALUES(?,?,?);", (time, self.current_session, message))
-        conn.commit()
+        self._pending_logs.append((timestamp, self.current_session, message))
 
-    def update_data(self, time, message):
+    def flush_database(self):
+        """
+        Writes all queued Logs and BadgeScans rows to the database in one transaction
+
+        :return: None
+        """
+        if self._pending_logs or self._pending_scans:
+            conn = self.get_database_connection()
+            conn.execute('BEGIN')
+            try:
+                conn.executemany("INSERT INTO Logs VALUES(?,?,?);", self._pending_logs)
+                conn.executemany("INSERT INTO BadgeScans VALUES(?,?,?,?,?,?,?,?)", self._pending_scans)
+                conn.execute('COMMIT')
+            except BaseException:
+                # Autocommit connection, so a failed transaction stays open and blocks every later BEGIN.
+                # Rows stay queued and are retried on the next flush
+                self.rollback(conn)
+                raise
+            self._pending_logs.clear()
+            self._pending_scans.clear()
+        self._last_database_flush = monotonic()
+
+    def retry_flush_database(self):
+        """
+        Flushes the database, but if it is locked or otherwise unavailable keeps the rows queued
+        and tries again after the next database_flush_interval rather than failing
+
+        :return: None
+        """
+        try:
+            self.flush_database()
+        except sqlite3.OperationalError as e:
+            print(f'Could not write to database, retrying later: {e}')
+            self._last_database_flush = monotonic()
+
+    def database_flush_due(self):
+        """
+        Checks if enough rows have been queued, or enough time has passed, to flush the database
+
+        :return: True if flush_database should be called
+        :rtype: bool
+        """
+        return (len(self._pending_logs) >= self.database_batch_size or
+                monotonic() - self._last_database_flush >= self.database_flush_interval)
+
+    def update_data(self, time, data):
         """
         Updates the structured data, moving things from ongoing to finished if at haunt
 
         :param time: Time of the message
-        :param message: Message received from udp socket
+        :param data: Message received from udp socket
+        :type data: bytes
         :return: None
         """
 
-        data = re.match(r'([ABCVH]) ([\w]{7,8})$', message)
-        if data is None:
-            # Not a station card combo. Adds data to notes
-            for id in self.ongoing:
-                self.ongoing[id].loc[0, 'Notes'] += f'{message.strip()}, '
+        ongoing = self.ongoing
+        scan = parse_scan(data)
+        if scan is None:
+            # Not a station card combo. Adds data to notes of everything ongoing
+            if ongoing:
+                self._notes.append(data.decode('ascii', 'replace').strip())
         else:
-            station, id = data[1], data[2]
+            station, id = scan
 
             # Finalizes anything prior to starting at first station
-            if station == 'A' and id in self.ongoing:
+            if station == 'A' and id in ongoing:
                 self.finalize(id)
 
             # Updates station time
-            self.ongoing[id].loc[0, station] = time
+            ongoing[id][COL[station]] = time
 
             # If last station has been reached, adds to final data and removes from ongoing
             if station == 'H':
@@ -310,9 +716,34 @@ class Logger(threading.Thread):
         :type message: string
         :return:
         """
-        time = datetime.now()
-        self.log_message(time, message)
-        self.update_data(time, message)
+        self.process_messages([(datetime.now(), message.encode('ascii', 'replace'))])
+        self.flush_database()
+
+    def process_messages(self, messages):
+        """
+        Logs messages and adds them to data. Database rows are queued until flush_database
+
+        :param messages: Messages to process, in order received
+        :type messages: list of (datetime, bytes)
+        :return: None
+        """
+        # Looked up once per batch rather than once per message
+        format_timestamp = self.format_timestamp
+        update_session = self.update_session
+        log_to_text_files = self.log_to_text_files
+        log_to_database = self.log_to_database
+        update_data = self.update_data
+
+        for time, data in messages:
+            # Only needed for the logs, update_data works on the raw bytes
+            message = data.decode('ascii', 'replace')
+            # Formatted once for both logs
+            timestamp = format_timestamp(time)
+            update_session(time)
+            log_to_text_files(timestamp, message)
+            log_to_database(timestamp, message)
+            update_data(time, data)
+        self.write_text_log_files()
 
     def add_from_text_log(self, log_file):
         """
@@ -324,45 +755,52 @@ class Logger(threading.Thread):
         """
         self.last_write = datetime(1900, 1, 1)
         self.current_session = self.last_write.date()
+        self._session_stamp = f'{self.current_session:%m.%d.%y}'
         self.log_files = None
         with open(log_file, 'r') as f:
             logs = f.readlines()
+
+        messages = []
         for l in logs:
             l = l.strip()
             try:
                 time, data = l.split(' - ')
                 time = datetime.strptime(time, '%Y-%m-%d %H:%M:%S')
-
-                self.update_session(time)
-                self.log_to_text_files(time, data)
-                self.log_to_database(time, data)
-                self.update_data(time, data)
+                messages.append((time, data.encode('ascii', 'replace')))
             except:
                 print(f'Could not parse "{l}"')
+
+        # Nothing is flushed until dump_data, so the whole file costs one commit
+        self.process_messages(messages)
+        self.close_text_log_files()
         print('Saving data...')
         self.dump_data()
 
     def finalize(self, id):
         """
-        Takes id's entry from ongoing and adds it to finished
+        Takes id's entry from ongoing and queues it for the BadgeScans table
 
         :param id: Card id
         :return: None
         """
         if id not in self.ongoing:
             raise UserWarning('Trying to finalize id not currently in ongoing.')
-        curr = self.ongoing[id]
-        curr = curr.iloc[0].values
-        curr[0] = id
-        curr[-1] = curr[-1][:-2]    # Removes ', ' from end of Notes
-        curr = tuple(curr)
-        del self.ongoing[id]
+        self._promote(id, self.ongoing.pop(id))
+        if not self.ongoing:
+            # No entry refers to the notes any more
+            self._notes.clear()
 
-        conn = self.get_database_connection()
-        c = conn.cursor()
-        c.execute("INSERT INTO BadgeScans VALUES(?,?,?,?,?,?,?,?)", curr)
-        conn.commit()
-        # self.finished.loc[len(self.finished)] = curr.values[0]
+    def _promote(self, id, row):
+        """
+        Fills in id and notes of an entry already taken out of ongoing, and queues it for the BadgeScans table
+
+        :param id: Card id
+        :param row: Entry laid out as COLUMNS
+        :return: None
+        """
+        row[COL['ID']] = id
+        row[COL['Notes']] = ', '.join(self._notes[row[COL['Notes']]:])
+        self._pending_scans.append(row)
 
     def dump_data(self):
         """
@@ -370,10 +808,13 @@ class Logger(threading.Thread):
 
         :return: None
         """
-        ids = list(self.ongoing.keys())
-        for id in ids:
-            self.finalize(id)
+        for id, row in self.ongoing.items():
+            self._promote(id, row)
+        self.ongoing.clear()
+        self._notes.clear()
+        self.flush_database()
 
 if __name__ == '__main__':
-    logger = Logger()
-    logger.listen()
\ No newline at end of file
+    with Logger() as logger:
+        logger.start()
+        logger.join()
\ No newline at end of file
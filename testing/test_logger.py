@@ -1,91 +1,211 @@
-from logger import Logger
+from src.logger import Logger, parse_scan
 from collections import namedtuple
+from time import monotonic, sleep
+import threading
+import sqlite3
+import socket
 import pytest
 import os
 
+TESTING_DIR = os.path.dirname(os.path.abspath(__file__))
+
 LoggerTestCase = namedtuple(
     'LoggerTestCase',
     [
         'description',
-        'log_file',
-        'data_file'
+        'log_file'
     ]
 )
 
 logger_test_cases = [
     LoggerTestCase(
         'test1',
-        'test1.txt',
-        'test1.csv'
+        'test1.txt'
     ),
     LoggerTestCase(
         'test2',
-        'test2.txt',
-        'test2.csv'
+        'test2.txt'
     )
 ]
 
-@pytest.fixture(scope='module', autouse=True)
-def remove_testing_output():
-    if os.path.exists('test_results.txt'):
-        os.remove('test_results.txt')
-
-@pytest.mark.parametrize('description, log_file, data_file', logger_test_cases)
-def test_logger(description, log_file, data_file):
-    # Create logger
-    l = Logger(
-        log_file=f'{description}_output.txt',
-        data_file=f'{description}_output.csv',
-    )
-    # Remove testing output files if they exist
-    if os.path.exists(l.log_file):
-        os.remove(l.log_file)
-    if os.path.exists(l.data_file):
-        os.remove(l.data_file)
+def read_messages(log_file):
+    """
+    Reads the messages out of a log file, dropping the timestamps
 
-    # Grab test log info, and feed it to logger. Ensure only the message gets sent
+    :param log_file: Name of log file
+    :type log_file: string
+    :return: list of string
+    """
     with open(log_file, 'r') as f:
-        logs = f.readlines()
-    for log in logs:
-        l.receive(log.split(' - ')[-1])
+        return [x.split(' - ')[-1].strip() for x in f.readlines()]
+
+def read_notes(database):
+    """
+    Reads id and notes of every BadgeScans row, in the order they were written
 
-    # Get output files
-    log_output = l.log_file
-    data_output = l.data_file
+    :param database: Name of database file
+    :type database: string
+    :return: list of (id, notes)
+    """
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute('SELECT id, notes FROM BadgeScans ORDER BY rowid').fetchall()
+    finally:
+        conn.close()
 
-    # Delete logger to ensure all functionality is tested
-    del l
+def expected_notes(log_file):
+    """
+    Works out the notes each entry should end up with: every message that is not a scan,
+    received while the entry was ongoing
 
-    # Testing log file
-    msgs = [description]
-    incorrect = False
+    :param log_file: Name of log file
+    :type log_file: string
+    :return: list of (id, notes), in the order the entries are finalized
+    """
+    ongoing = {}
+    finished = []
     with open(log_file, 'r') as f:
-        input_logs = f.readlines()
-        input_logs = [x.split(' - ')[-1].strip() for x in input_logs]
-    with open(log_output, 'r') as f:
-        output_logs = f.readlines()
-        output_logs = [x.split(' - ')[-1].strip() for x in output_logs]
+        for l in f.readlines():
+            try:
+                time, data = l.strip().split(' - ')
+            except ValueError:
+                continue
+            scan = parse_scan(data.encode('ascii', 'replace'))
+            if scan is None:
+                for notes in ongoing.values():
+                    notes.append(data.strip())
+                continue
+            station, id = scan
+            if station == 'A' and id in ongoing:
+                finished.append((id, ongoing.pop(id)))
+            ongoing.setdefault(id, [])
+            if station == 'H':
+                finished.append((id, ongoing.pop(id)))
+    finished += ongoing.items()
+    return [(id, ', '.join(notes)) for id, notes in finished]
+
+@pytest.mark.parametrize('data, expected', [
+    (b'A 11111111', ('A', '11111111')),
+    (b'H 1111111', ('H', '1111111')),
+    (b'V 64C73563', ('V', '64C73563')),
+    (b'B ab_CD_12', ('B', 'ab_CD_12')),
+    (b'C _______', ('C', '_______')),
+    # Trailing whitespace is ignored
+    (b'A 11111111\n', ('A', '11111111')),
+    (b'A 11111111\r\n', ('A', '11111111')),
+    (b'A 11111111 ', ('A', '11111111')),
+    # Wrong length
+    (b'A 111111', None),
+    (b'A 111111111', None),
+    (b'A ', None),
+    (b'', None),
+    # Bad station or separator
+    (b'D 11111111', None),
+    (b'a 11111111', None),
+    (b'A_11111111', None),
+    (b'AB11111111', None),
+    (b' A 11111111', None),
+    # Characters outside [0-9A-Za-z_]
+    (b'A 1111-111', None),
+    (b'A 1111 111', None),
+    (b'A 1111111\xe9', None),
+    ('A 111111\u00e9'.encode('utf-8'), None),
+    (b'V connected to server', None),
+])
+def test_parse_scan(data, expected):
+    assert parse_scan(data) == expected
+
+@pytest.mark.parametrize('description, log_file', logger_test_cases)
+def test_logger(description, log_file, tmp_path):
+    log_output = str(tmp_path / f'{description}_output.txt')
+    database = str(tmp_path / f'{description}_output.db')
+
+    # Grab test log info, and feed it to logger. Ensure only the message gets sent
+    input_logs = read_messages(os.path.join(TESTING_DIR, log_file))
+    with Logger(log_files=[log_output], database=database) as l:
+        for log in input_logs:
+            l.receive(log)
+
+    assert read_messages(log_output) == input_logs
+
+def test_notes_from_text_log(tmp_path, monkeypatch):
+    # add_from_text_log writes its text logs under ./data
+    monkeypatch.chdir(tmp_path)
+    log_file = os.path.join(TESTING_DIR, 'test2.txt')
+    database = str(tmp_path / 'scans.db')
+
+    with Logger(database=database) as l:
+        l.add_from_text_log(log_file)
+
+    rows = read_notes(database)
+    assert any(notes for id, notes in rows)
+    assert rows == expected_notes(log_file)
+
+def test_notes_of_overlapping_entries(tmp_path):
+    database = str(tmp_path / 'scans.db')
+
+    with Logger(log_files=[str(tmp_path / 'log.txt')], database=database) as l:
+        l.receive('A 11111111')
+        l.receive('first')
+        # Starts after a note is already shared
+        l.receive('A 2222222')
+        l.receive('second')
+        l.receive('H 11111111')
+        # 2222222 is still ongoing, so its notes are kept
+        l.receive('third')
+        l.receive('H 2222222')
+        # Nothing ongoing any more, so the next entry starts from fresh notes
+        l.receive('first and only')
+        l.receive('A 33333333')
+        l.receive('fourth')
+        l.receive('H 33333333')
+        # Still ongoing when the logger is closed
+        l.receive('A 44444444')
+        l.receive('fifth')
+
+    assert read_notes(database) == [
+        ('11111111', 'first, second'),
+        ('2222222', 'second, third'),
+        ('33333333', 'fourth'),
+        ('44444444', 'fifth'),
+    ]
 
-    if len(input_logs) != len(output_logs):
-        incorrect = True
-        msgs.append('  Log files do not contain same number of rows')
-    for i in range(min(len(input_logs), len(output_logs))):
-        if input_logs[i] != output_logs[i]:
-            incorrect = True
-            msgs.append(f'    Log files do not match at row {i}')
+@pytest.mark.parametrize('receivers', [1, 2])
+def test_udp_loopback(receivers, tmp_path):
+    database = str(tmp_path / 'scans.db')
+    threads = threading.enumerate()
+    cards = 50
 
-    if not incorrect:
-        msgs[0] += ' Passed!'
-    else:
-        msgs[0] += ' Failed :('
+    with Logger(log_files=[str(tmp_path / 'log.txt')], database=database,
+                udp_socket=('127.0.0.1', 0), receivers=receivers) as l:
+        l.start()
+        address = (l.udp_host, l.udp_port)
+        # A socket per card, so with several receivers the kernel spreads them across all of them
+        senders = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for i in range(cards)]
+        for i, sender in enumerate(senders):
+            for message in (f'A {i:08d}', 'note', f'H {i:08d}'):
+                sender.sendto(message.encode('ascii'), address)
+        for sender in senders:
+            sender.close()
 
-    with open('test_results.txt', 'a') as f:
-        for l in msgs:
-            f.write(f'{l}\n')
+        # Waits for the writer to get everything into the database before stopping
+        conn = sqlite3.connect(database)
+        deadline = monotonic() + 10
+        while conn.execute('SELECT COUNT(*) FROM Logs').fetchone()[0] < 3 * cards and monotonic() < deadline:
+            sleep(0.1)
+        conn.close()
 
-    if incorrect:
-        raise Exception('Test failed')
+    assert not l.is_alive()
+    assert threading.enumerate() == threads
+    conn = sqlite3.connect(database)
+    try:
+        assert conn.execute('SELECT COUNT(*) FROM Logs').fetchone()[0] == 3 * cards
+        assert conn.execute('SELECT COUNT(*) FROM BadgeScans '
+                            'WHERE a_time IS NOT NULL AND h_time IS NOT NULL').fetchone()[0] == cards
+        assert conn.execute('SELECT COUNT(*) FROM BadgeScans').fetchone()[0] == cards
+    finally:
+        conn.close()
 
 
 if __name__ == '__main__':
-    pytest.main(__file__)
\ No newline at end of file
+    pytest.main([__file__])